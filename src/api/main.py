@@ -32,6 +32,14 @@ def startup():
     ENGINE = SearchEngine(embedder, cache, dim, index_path="faiss.index")
     ENGINE.index_documents(docs)
 
+
+@app.on_event("shutdown")
+def shutdown():
+    # flush queued cache writes before the process exits
+    if ENGINE is not None:
+        ENGINE.cache.close()
+
+
 @app.post("/search")
 def search(req: SearchRequest):
     global ENGINE
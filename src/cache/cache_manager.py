@@ -2,21 +2,162 @@
 import sqlite3
 import os
 import pickle
+import queue
+import threading
 import time
+import weakref
+from contextlib import contextmanager
 from typing import Optional
 import numpy as np
 
 CACHE_DB = os.environ.get('CACHE_DB', 'embeddings_cache.db')
 
+# Optional eviction: keep at most N rows / drop rows untouched for N seconds (0 = disabled)
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '0'))
+CACHE_MAX_AGE = float(os.environ.get('CACHE_MAX_AGE', '0'))
+
+# Max number of queued writes committed in a single transaction
+WRITE_BATCH_SIZE = 256
+
+# Max number of reader connections shared by all threads
+READ_POOL_SIZE = 8
+
+_STOP = object()
+
 
 class CacheManager:
-    def __init__(self, db_path: str = CACHE_DB):
+    """
+    Thread-safe SQLite embedding cache.
+
+    For a file DB:
+    - WAL journaling so readers never block on the writer
+    - a bounded pool of reader connections shared by all threads
+    - a single background writer thread that batches inserts
+    - optional eviction (LRU by `updated_at` and/or max row count)
+
+    ':memory:' is meant for tests: it uses one connection shared (under a lock)
+    by readers and the writer, so reads wait while a batch is being written.
+
+    Queued writes are committed on close(), when the manager is garbage
+    collected, or at interpreter exit.
+    """
+
+    def __init__(self, db_path: str = CACHE_DB, max_entries: int = CACHE_MAX_ENTRIES,
+                 max_age: float = CACHE_MAX_AGE):
         self.db_path = db_path
-        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        self._create_table()
+        # all state lives on the store so the writer thread does not keep this object alive
+        self._store = _CacheStore(db_path, max_entries, max_age)
+        self._finalizer = weakref.finalize(self, self._store.close)
+
+    @property
+    def max_entries(self) -> int:
+        return self._store.max_entries
+
+    @max_entries.setter
+    def max_entries(self, value: int):
+        self._store.max_entries = value
+
+    @property
+    def max_age(self) -> float:
+        return self._store.max_age
+
+    @max_age.setter
+    def max_age(self, value: float):
+        self._store.max_age = value
+
+    @property
+    def is_running(self) -> bool:
+        """True while the background writer is accepting and committing writes."""
+        return self._store.is_running
+
+    @property
+    def open_connections(self) -> int:
+        """Number of SQLite connections currently held (readers + writer)."""
+        return self._store.open_connections
+
+    def get(self, doc_id: str, hash_val: str) -> Optional[np.ndarray]:
+        return self._store.get(doc_id, hash_val)
+
+    def set(self, doc_id: str, hash_val: str, embedding: np.ndarray):
+        self._store.set(doc_id, hash_val, embedding)
+
+    def flush(self):
+        """Block until every write queued before this call has been committed."""
+        self._store.flush()
+
+    def all_embeddings(self):
+        return self._store.all_embeddings()
+
+    def evict(self):
+        """Apply the eviction policy now (the writer also runs it after every batch)."""
+        self._store.evict()
+
+    def close(self):
+        self._finalizer()
 
-    def _create_table(self):
-        cur = self._conn.cursor()
+
+class _CacheStore:
+    def __init__(self, db_path: str, max_entries: int, max_age: float):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._in_memory = db_path == ':memory:'
+
+        self._conns = []
+        self._conns_lock = threading.Lock()
+        self._pool = queue.Queue()
+        self._pool_size = 1 if self._in_memory else READ_POOL_SIZE
+        self._readers = 0
+
+        # writes not yet committed by the writer thread, so get() sees its own writes
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._queue = queue.Queue()
+        # guards _closed so nothing can be enqueued after _STOP
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # First pooled connection; for ':memory:' it is the only one and keeps the DB alive
+        conn = self._connect()
+        self._create_table(conn)
+        self._readers = 1
+        self._pool.put(conn)
+
+        self._writer = threading.Thread(target=self._writer_loop, name='cache-writer', daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        # check_same_thread=False because pooled connections move between threads;
+        # each one is only used by one thread at a time
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        if not self._in_memory:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA mmap_size=268435456')
+        conn.execute('PRAGMA cache_size=-65536')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        with self._conns_lock:
+            self._conns.append(conn)
+        return conn
+
+    @contextmanager
+    def _checkout(self):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._conns_lock:
+                create = self._readers < self._pool_size
+                if create:
+                    self._readers += 1
+            conn = self._connect() if create else self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @staticmethod
+    def _create_table(conn: sqlite3.Connection):
+        cur = conn.cursor()
         cur.execute('''
             CREATE TABLE IF NOT EXISTS embeddings (
                 doc_id TEXT PRIMARY KEY,
@@ -25,38 +166,173 @@ class CacheManager:
                 updated_at REAL
             )
         ''')
-        self._conn.commit()
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_updated_at ON embeddings (updated_at)')
+        conn.commit()
+
+    @property
+    def is_running(self) -> bool:
+        return not self._closed and self._writer.is_alive()
+
+    @property
+    def open_connections(self) -> int:
+        with self._conns_lock:
+            return len(self._conns)
 
     def get(self, doc_id: str, hash_val: str) -> Optional[np.ndarray]:
-        cur = self._conn.cursor()
-        cur.execute('SELECT hash, embedding FROM embeddings WHERE doc_id = ?', (doc_id,))
-        row = cur.fetchone()
+        with self._pending_lock:
+            pending = self._pending.get(doc_id)
+        if pending is not None:
+            stored_hash, blob = pending
+            return pickle.loads(blob) if stored_hash == hash_val else None
+
+        with self._checkout() as conn:
+            row = conn.execute('SELECT hash, embedding FROM embeddings WHERE doc_id = ?',
+                               (doc_id,)).fetchone()
         if row is None:
             return None
         stored_hash, blob = row
         if stored_hash != hash_val:
             return None
         emb = pickle.loads(blob)
+        if self._eviction_enabled():
+            # refresh recency for LRU; applied by the writer, never blocks the reader
+            self._enqueue(('touch', doc_id, time.time()))
         return emb
 
     def set(self, doc_id: str, hash_val: str, embedding: np.ndarray):
-        cur = self._conn.cursor()
+        # pickle on the caller's thread so serialization errors surface here
         blob = pickle.dumps(embedding)
-        cur.execute('REPLACE INTO embeddings (doc_id, hash, embedding, updated_at) VALUES (?, ?, ?, ?)',
-                    (doc_id, hash_val, sqlite3.Binary(blob), time.time()))
-        self._conn.commit()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('CacheManager is closed')
+            with self._pending_lock:
+                self._pending[doc_id] = (hash_val, blob)
+            self._queue.put(('set', doc_id, (hash_val, blob, time.time())))
+
+    def _enqueue(self, item) -> bool:
+        with self._lock:
+            if self._closed:
+                return False
+            self._queue.put(item)
+            return True
+
+    def flush(self):
+        # wait for a marker queued now, so later writes from other threads don't delay us
+        done = threading.Event()
+        if self._enqueue(('flush', None, done)):
+            done.wait()
 
     def all_embeddings(self):
-        cur = self._conn.cursor()
-        cur.execute('SELECT doc_id, embedding FROM embeddings')
-        rows = cur.fetchall()
+        self.flush()
+        with self._checkout() as conn:
+            rows = conn.execute('SELECT doc_id, embedding FROM embeddings').fetchall()
         result = {}
         for doc_id, blob in rows:
             result[doc_id] = pickle.loads(blob)
         return result
 
+    def evict(self):
+        if not self._enqueue(('evict', None, None)):
+            raise RuntimeError('CacheManager is closed')
+        self.flush()
+
+    def _eviction_enabled(self) -> bool:
+        return self.max_entries > 0 or self.max_age > 0
+
+    def _evict(self, conn: sqlite3.Connection):
+        if self.max_age > 0:
+            conn.execute('DELETE FROM embeddings WHERE updated_at < ?', (time.time() - self.max_age,))
+        if self.max_entries > 0:
+            conn.execute('''
+                DELETE FROM embeddings WHERE doc_id IN (
+                    SELECT doc_id FROM embeddings ORDER BY updated_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+
+    def _writer_loop(self):
+        # ':memory:' has a single connection, borrowed from the pool per batch
+        conn = None if self._in_memory else self._connect()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            sets = {}
+            touches = {}
+            flushes = []
+            evict = False
+            for item in batch:
+                if item is _STOP:
+                    stop = True
+                    continue
+                kind, doc_id, payload = item
+                if kind == 'set':
+                    sets[doc_id] = payload
+                elif kind == 'touch':
+                    touches[doc_id] = payload
+                elif kind == 'flush':
+                    flushes.append(payload)
+                else:
+                    evict = True
+
+            try:
+                if conn is None:
+                    with self._checkout() as pooled:
+                        self._write_batch(pooled, sets, touches, evict)
+                else:
+                    self._write_batch(conn, sets, touches, evict)
+            except Exception as e:
+                # keep the writer alive; the failed entries were not persisted,
+                # so stop serving them from _pending as well
+                print(f"[WARN] Cache write failed, dropped {len(sets)} entries: {e}")
+            finally:
+                self._release_pending(sets)
+                for done in flushes:
+                    done.set()
+            if stop:
+                return
+
+    def _write_batch(self, conn: sqlite3.Connection, sets, touches, evict: bool):
+        if not sets and not touches and not evict:
+            return
+
+        with conn:
+            if sets:
+                conn.executemany(
+                    'REPLACE INTO embeddings (doc_id, hash, embedding, updated_at) VALUES (?, ?, ?, ?)',
+                    [(doc_id, h, sqlite3.Binary(blob), ts)
+                     for doc_id, (h, blob, ts) in sets.items()])
+            if touches:
+                conn.executemany('UPDATE embeddings SET updated_at = ? WHERE doc_id = ?',
+                                 [(ts, doc_id) for doc_id, ts in touches.items()])
+            if evict or self._eviction_enabled():
+                self._evict(conn)
+
+    def _release_pending(self, sets):
+        with self._pending_lock:
+            for doc_id, (_, blob, _) in sets.items():
+                # a newer set() may have replaced the entry while this batch was written
+                if self._pending.get(doc_id, (None, None))[1] is blob:
+                    del self._pending[doc_id]
+
     def close(self):
-        self._conn.close()
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        if threading.current_thread() is self._writer:
+            # finalizer ran from a GC pass on the writer thread; it exits on _STOP
+            return
+        self._writer.join()
+        with self._conns_lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns.clear()
 
 
 if __name__ == '__main__':
@@ -64,4 +340,5 @@ if __name__ == '__main__':
     import numpy as np
     cm = CacheManager(':memory:')
     cm.set('doc1', 'h1', np.array([1.0, 2.0]))
-    print(cm.get('doc1', 'h1'))
\ No newline at end of file
+    print(cm.get('doc1', 'h1'))
+    cm.close()
@@ -1,5 +1,14 @@
+import gc
+import pickle
+import sqlite3
+import subprocess
+import sys
+import threading
+import weakref
+
 import numpy as np
-from src.cache.cache_manager import CacheManager
+import pytest
+from src.cache.cache_manager import CacheManager, READ_POOL_SIZE
 
 def test_cache_set_get():
     cm = CacheManager(':memory:')
@@ -7,3 +16,209 @@ def test_cache_set_get():
     cm.set('doc1','h1',arr)
     out = cm.get('doc1','h1')
     assert out.tolist() == arr.tolist()
+
+def test_cache_hash_mismatch_and_flush(tmp_path):
+    cm = CacheManager(str(tmp_path / 'cache.db'))
+    cm.set('doc1', 'h1', np.array([1.0]))
+    cm.flush()
+    assert cm.get('doc1', 'h2') is None
+    assert cm.get('doc1', 'h1').tolist() == [1.0]
+    cm.close()
+
+def test_cache_get_returns_copy_of_pending_write(tmp_path):
+    cm = CacheManager(str(tmp_path / 'cache.db'))
+    arr = np.array([1.0, 2.0])
+    cm.set('doc1', 'h', arr)
+    out = cm.get('doc1', 'h')
+    out[0] = 99.0
+    arr[1] = 99.0
+    assert cm.get('doc1', 'h').tolist() == [1.0, 2.0]
+    cm.close()
+
+def test_cache_concurrent_access(tmp_path):
+    cm = CacheManager(str(tmp_path / 'cache.db'))
+    errors = []
+
+    def worker(n):
+        try:
+            for i in range(50):
+                doc_id = f'doc{n}_{i}'
+                cm.set(doc_id, 'h', np.array([float(i)]))
+                assert cm.get(doc_id, 'h').tolist() == [float(i)]
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert len(cm.all_embeddings()) == 400
+    cm.close()
+
+def test_cache_connections_bounded_across_short_lived_threads(tmp_path):
+    cm = CacheManager(str(tmp_path / 'cache.db'))
+
+    def worker(i):
+        cm.set(f'doc{i}', 'h', np.array([float(i)]))
+        cm.get(f'doc{i}', 'h')
+        cm.get('missing', 'h')
+
+    for i in range(200):
+        t = threading.Thread(target=worker, args=(i,))
+        t.start()
+        t.join()
+    # reader pool + the writer's own connection
+    assert cm.open_connections <= READ_POOL_SIZE + 1
+    assert len(cm.all_embeddings()) == 200
+    cm.close()
+
+def test_cache_flush_not_starved_by_concurrent_writes(tmp_path):
+    cm = CacheManager(str(tmp_path / 'cache.db'), max_entries=1000)
+    cm.set('doc0', 'h', np.array([0.0]))
+    stop = threading.Event()
+
+    def busy():
+        i = 0
+        while not stop.is_set():
+            cm.set(f'busy{i % 50}', 'h', np.array([float(i)]))
+            cm.get('doc0', 'h')
+            i += 1
+
+    threads = [threading.Thread(target=busy) for _ in range(4)]
+    for t in threads:
+        t.start()
+    try:
+        flusher = threading.Thread(target=cm.flush)
+        flusher.start()
+        flusher.join(timeout=5)
+        assert not flusher.is_alive()
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+    cm.close()
+
+def test_cache_writes_survive_exit_without_close(tmp_path):
+    db = str(tmp_path / 'cache.db')
+    script = (
+        "import numpy as np\n"
+        "from src.cache.cache_manager import CacheManager\n"
+        f"cm = CacheManager({db!r})\n"
+        "for i in range(3000):\n"
+        "    cm.set(f'doc{i}', 'h', np.array([float(i)]))\n"
+    )
+    subprocess.run([sys.executable, '-c', script], check=True)
+    cm = CacheManager(db)
+    assert len(cm.all_embeddings()) == 3000
+    cm.close()
+
+def test_cache_dropped_manager_is_collected_and_persisted(tmp_path):
+    db = str(tmp_path / 'cache.db')
+    cm = CacheManager(db)
+    for i in range(1000):
+        cm.set(f'doc{i}', 'h', np.array([float(i)]))
+    ref = weakref.ref(cm)
+    del cm
+    gc.collect()
+    assert ref() is None
+    cm = CacheManager(db)
+    assert len(cm.all_embeddings()) == 1000
+    cm.close()
+
+def test_cache_close_persists_queued_writes(tmp_path):
+    db = str(tmp_path / 'cache.db')
+    cm = CacheManager(db)
+    for i in range(1000):
+        cm.set(f'doc{i}', 'h', np.array([float(i)]))
+    cm.close()
+    assert not cm.is_running
+    cm = CacheManager(db)
+    assert len(cm.all_embeddings()) == 1000
+    cm.close()
+
+def test_cache_set_after_close_raises():
+    cm = CacheManager(':memory:')
+    cm.close()
+    with pytest.raises(RuntimeError):
+        cm.set('doc1', 'h', np.array([1.0]))
+
+def test_cache_unpicklable_value_raises_in_caller():
+    cm = CacheManager(':memory:')
+    with pytest.raises((pickle.PicklingError, AttributeError)):
+        cm.set('doc1', 'h', lambda: None)
+    assert cm.get('doc1', 'h') is None
+    cm.set('doc2', 'h', np.array([2.0]))
+    cm.flush()
+    assert cm.is_running
+    assert cm.get('doc2', 'h').tolist() == [2.0]
+    cm.close()
+
+def test_cache_failed_batch_is_dropped_and_writer_survives(tmp_path):
+    db = str(tmp_path / 'cache.db')
+    cm = CacheManager(db)
+    conn = sqlite3.connect(db)
+    conn.execute('''
+        CREATE TRIGGER reject_bad BEFORE INSERT ON embeddings
+        WHEN NEW.doc_id = 'bad' BEGIN SELECT RAISE(ABORT, 'rejected'); END
+    ''')
+    conn.commit()
+    conn.close()
+
+    cm.set('bad', 'h', np.array([1.0]))
+    cm.flush()
+    assert cm.is_running
+    # never persisted, so it must not be served as a hit
+    assert cm.get('bad', 'h') is None
+
+    cm.set('good', 'h', np.array([2.0]))
+    cm.flush()
+    assert cm.get('good', 'h').tolist() == [2.0]
+    cm.close()
+
+def test_cache_reads_not_blocked_by_open_write_transaction(tmp_path):
+    db = str(tmp_path / 'cache.db')
+    cm = CacheManager(db)
+    cm.set('doc1', 'h', np.array([1.0]))
+    cm.flush()
+
+    writer = sqlite3.connect(db)
+    assert writer.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    # hold an exclusive write transaction; under a rollback journal this blocks readers
+    writer.execute('BEGIN EXCLUSIVE')
+    writer.execute("REPLACE INTO embeddings VALUES ('doc2', 'h', x'00', 0)")
+
+    result = {}
+    reader = threading.Thread(target=lambda: result.setdefault('emb', cm.get('doc1', 'h')))
+    reader.start()
+    reader.join(timeout=5)
+    assert not reader.is_alive()
+    assert result['emb'].tolist() == [1.0]
+
+    writer.rollback()
+    writer.close()
+    cm.close()
+
+def test_cache_lru_hit_protects_from_eviction():
+    cm = CacheManager(':memory:', max_entries=2)
+    cm.set('a', 'h', np.array([1.0]))
+    cm.flush()
+    cm.set('b', 'h', np.array([2.0]))
+    cm.flush()
+    assert cm.get('a', 'h') is not None  # refreshes a's recency
+    cm.flush()
+    cm.set('c', 'h', np.array([3.0]))
+    cm.flush()
+    assert sorted(cm.all_embeddings()) == ['a', 'c']
+    cm.close()
+
+def test_cache_explicit_evict(tmp_path):
+    cm = CacheManager(str(tmp_path / 'cache.db'))
+    for i in range(5):
+        cm.set(f'doc{i}', 'h', np.array([float(i)]))
+        cm.flush()
+    cm.max_entries = 1
+    cm.evict()
+    assert list(cm.all_embeddings()) == ['doc4']
+    cm.close()